@@ -2,7 +2,32 @@ import pandas as pd
 import streamlit as st
 import plotly.express as px
 import plotly.graph_objects as go
-import re
+import os
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+
+# Leading point estimate of a "median [low-high]" cell; plain values don't match.
+# Kept as a pattern string with a named group so Arrow compute can run it natively.
+_NUM_PATTERN = r'^\s*(?P<median>[-\d.]+)\s*\['
+
+# CSV header -> snake_case column name used throughout the dashboard
+def _clean_col_name(col):
+    return col.replace(' (%)', '_percent').replace(' (15-49)', '_15_49').replace(' ', '_')
+
+# Placeholders the source CSVs use for missing values
+NA_VALUES = ['Nodata', 'na', 'No data']
+
+# Columns of the merged frame used by the KPIs and charts
+COL_LIVING = 'Count_median_living'
+COL_DEATHS = 'Count_median_deaths'
+COL_ART_ADULT = 'Estimated_ART_coverage_among_people_living_with_HIV_percent_median'
+COL_ART_CHILD = 'Estimated_ART_coverage_among_children_percent_median'
+COL_PMTCT = 'Percentage_Recieved_median'
+
+# On-disk copy of the cleaned, merged frame; survives process restarts.
+# Bump CACHE_VERSION whenever the cleaning changes so old copies are ignored.
+CACHE_VERSION = 1
+CACHE_PATH = f"cleaned.v{CACHE_VERSION}.parquet"
 
 # -----------------------
 # Page Configuration
@@ -60,29 +85,58 @@ st.markdown("""
 # -----------------------
 # Data Loading and Cleaning
 # -----------------------
+FILES = {
+    "art": "ART coverage by country.csv",
+    "paediatric_art": "Paediatric ART coverage by country.csv",
+    "adult_cases": "Number of cases in adults (15-49) by country.csv",
+    "deaths": "Number of deaths by country.csv",
+    "living": "Number of people living with HIV by country.csv",
+    "pmtct": "prevention of mother-to-child transmission (PMTCT).csv"
+}
+
+# data_version is the newest CSV mtime; as part of the memo key, editing a CSV
+# reloads the data without clearing Streamlit's cache
 @st.cache_data
-def load_and_clean_data():
-    files = {
-        "art": "ART coverage by country.csv",
-        "paediatric_art": "Paediatric ART coverage by country.csv",
-        "adult_cases": "Number of cases in adults (15-49) by country.csv",
-        "deaths": "Number of deaths by country.csv",
-        "living": "Number of people living with HIV by country.csv",
-        "pmtct": "prevention of mother-to-child transmission (PMTCT).csv"
+def load_and_clean_data(data_version):
+    # The "median [low-high]" columns the medians are extracted from; the
+    # CSVs' own _median/_min/_max, year and reported-count columns go unused
+    value_cols = {
+        "art": ["Estimated number of people living with HIV", "Estimated ART coverage among people living with HIV (%)"],
+        "paediatric_art": ["Estimated number of children needing ART based on WHO methods", "Estimated ART coverage among children (%)"],
+        "adult_cases": ["Count"],
+        "deaths": ["Count"],
+        "living": ["Count"],
+        "pmtct": ["Needing antiretrovirals", "Percentage Recieved"]
     }
+
+    # Skip the CSV parse and cleanup if the cache is newer than every CSV
+    if os.path.exists(CACHE_PATH) and os.path.getmtime(CACHE_PATH) >= data_version:
+        try:
+            return pd.read_parquet(CACHE_PATH, engine='pyarrow')
+        except (OSError, ValueError):
+            # An unreadable cache is just a miss; it's rebuilt and rewritten below
+            pass
     
-    dataframes = {name: pd.read_csv(path) for name, path in files.items()}
+    def read(name):
+        usecols = ['Country', *value_cols[name], 'WHO Region']
+        return pd.read_csv(FILES[name], usecols=usecols, na_values=NA_VALUES, engine='pyarrow', dtype_backend='pyarrow')
+
+    # The CSV parser releases the GIL, so the six reads can overlap
+    with ThreadPoolExecutor(max_workers=len(FILES)) as ex:
+        dataframes = dict(zip(FILES, ex.map(read, FILES)))
 
     def clean_and_extract(df):
         # A more robust column name cleaning
-        df.columns = [col.replace(' (%)', '_percent').replace(' (15-49)', '_15_49').replace(' ', '_') for col in df.columns]
+        df.rename(columns=_clean_col_name, inplace=True)
         
         for col in df.columns:
-            if df[col].dtype == 'object':
-                df[col] = df[col].replace({'Nodata': pd.NA, 'na': pd.NA, 'No data': pd.NA})
-                if df[col].astype(str).str.contains(r'\[', na=False).any():
+            if pd.api.types.is_string_dtype(df[col]):
+                # pandas < 2.2 has no str.extract for ArrowDtype strings, so go through StringDtype
+                median = pd.to_numeric(df[col].astype('string').str.extract(_NUM_PATTERN, expand=False), errors='coerce')
+                # The extract doubles as the probe for bracketed columns
+                if median.notna().any():
                     # Create a new median column from the string column
-                    df[f'{col}_median'] = df[col].apply(lambda x: float(re.split(r'\s|\[', str(x))[0]) if pd.notna(x) else pd.NA)
+                    df[f'{col}_median'] = median.astype('float64')
         
         # Select only necessary columns
         median_cols = [col for col in df.columns if 'median' in col]
@@ -90,25 +144,113 @@ def load_and_clean_data():
         keep_cols = base_cols + median_cols
         
         df = df[[col for col in keep_cols if col in df.columns]]
-        return df
+        # float32 is plenty for country-level counts and percentages
+        return df.astype({col: 'float32' for col in df.select_dtypes('number').columns})
 
     cleaned_dfs = {name: clean_and_extract(df) for name, df in dataframes.items()}
     
     # --- FIX: Explicitly rename columns before merging ---
-    cleaned_dfs['living'].rename(columns={'Count_median': 'Count_median_living'}, inplace=True)
-    cleaned_dfs['deaths'].rename(columns={'Count_median': 'Count_median_deaths'}, inplace=True)
+    cleaned_dfs['living'].rename(columns={'Count_median': COL_LIVING}, inplace=True)
+    cleaned_dfs['deaths'].rename(columns={'Count_median': COL_DEATHS}, inplace=True)
     cleaned_dfs['adult_cases'].rename(columns={'Count_median': 'Count_median_adult_cases'}, inplace=True)
     
-    # Start merge with the 'living' dataframe
-    df_final = cleaned_dfs['living']
-    # Merge other dataframes
-    for name, df in cleaned_dfs.items():
-        if name != 'living':
-            df_final = pd.merge(df_final, df.drop(columns=['WHO_Region'], errors='ignore'), on='Country', how='outer')
-            
-    return df_final.dropna(subset=['WHO_Region'])
+    # Align every dataframe on Country in one join, starting from 'living'.
+    # join() concatenates along the union index when Country is unique in every
+    # frame; the yearly count files repeat it, so it falls back to index merges.
+    living = cleaned_dfs['living'].set_index('Country')
+    frames = [df.drop(columns=['WHO_Region'], errors='ignore').set_index('Country')
+              for name, df in cleaned_dfs.items() if name != 'living']
+    df_final = living.join(frames, how='outer').reset_index()
+
+    df_final = df_final.dropna(subset=['WHO_Region'])
+    # Categorical keys after the join, since mismatched categories would decay to object there
+    df_final = df_final.astype({'Country': 'category', 'WHO_Region': 'category'})
+    # Write to a temp file and swap it in, so a crash mid-write never leaves a partial cache
+    tmp_path = f"{CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        df_final.to_parquet(tmp_path, engine='pyarrow', compression='zstd')
+        os.replace(tmp_path, CACHE_PATH)
+    except OSError:
+        # Read-only or full disks just fall back to parsing the CSVs each time
+        with suppress(OSError):
+            os.remove(tmp_path)
+    return df_final
+
+@st.cache_data
+def region_aggregates(data):
+    # Region totals over the full dataset; these don't depend on the sidebar filters.
+    # Summed in float64 like the KPIs, since billions don't fit exactly in float32.
+    living = data[COL_LIVING].astype('float64')
+    return {
+        'living': living.groupby(data['WHO_Region'], observed=True, sort=False).sum().reset_index(),
+    }
+
+data_version = max(os.path.getmtime(path) for path in FILES.values())
+data = load_and_clean_data(data_version)
+region_totals = region_aggregates(data)
+# WHO_Region was made categorical after the dropna, so its categories are exactly
+# the sorted regions present; no per-rerun unique() + sort needed
+region_choices = ['All'] + data['WHO_Region'].cat.categories.tolist()
+
+# -----------------------
+# Chart Builders
+# -----------------------
+# Figures are cached so a rerun that doesn't change their inputs reuses them.
+@st.cache_resource(max_entries=8)
+def build_map(data_version, region_key, countries_key, _filtered_data):
+    # Keyed on the data version and the sidebar selection _filtered_data came
+    # from, so the frame itself is never hashed but a data reload still rebuilds
+    map_data = _filtered_data[['Country', COL_LIVING]].dropna()
+    fig_map = px.choropleth(
+        map_data,
+        locations="Country",
+        locationmode="country names",
+        color=COL_LIVING,
+        color_continuous_scale=px.colors.sequential.Reds,
+        template="plotly_dark",
+        hover_name="Country"
+    )
+    fig_map.update_layout(margin={"r":0,"t":0,"l":0,"b":0}, paper_bgcolor="#1A1C2A")
+    return fig_map
+
+@st.cache_data(max_entries=8)
+def build_region_pie(region_data):
+    fig_pie = px.pie(
+        region_data,
+        names='WHO_Region',
+        values=COL_LIVING,
+        # Colour by region in alphabetical order, so colours don't depend on row order
+        color='WHO_Region',
+        category_orders={'WHO_Region': sorted(region_data['WHO_Region'])},
+        template="plotly_dark",
+        hole=0.4
+    )
+    fig_pie.update_layout(paper_bgcolor="#1A1C2A", legend_orientation="h")
+    return fig_pie
+
+@st.cache_data(max_entries=8)
+def build_art_bar(art_summary):
+    fig_art = px.bar(
+        art_summary,
+        x='ART_Type',
+        y='Coverage',
+        color='ART_Type',
+        template="plotly_dark",
+        title="Average Coverage"
+    )
+    fig_art.update_layout(paper_bgcolor="#1A1C2A")
+    return fig_art
 
-data = load_and_clean_data()
+@st.cache_data(max_entries=8)
+def build_pmtct_gauge(avg_pmtct):
+    fig_pmtct = go.Figure(go.Indicator(
+        mode="gauge+number",
+        value=avg_pmtct,
+        title={'text': "Average PMTCT Coverage"},
+        gauge={'axis': {'range': [None, 100]}, 'bar': {'color': "#2ECC71"}}
+    ))
+    fig_pmtct.update_layout(paper_bgcolor="#1A1C2A", font={'color': "white"})
+    return fig_pmtct
 
 # -----------------------
 # Sidebar Filters
@@ -117,10 +259,12 @@ st.sidebar.image("https://pngimg.com/uploads/red_ribbon/red_ribbon_PNG3.png", wi
 st.sidebar.title("Dashboard Controls")
 selected_region = st.sidebar.selectbox(
     "Select WHO Region:",
-    options=['All'] + sorted(data['WHO_Region'].unique().tolist())
+    options=region_choices
 )
 
-filtered_data = data.copy()
+# Nothing below writes to filtered_data, so the unfiltered case can share data
+filtered_data = data
+selected_countries = []
 if selected_region != 'All':
     filtered_data = data[data['WHO_Region'] == selected_region]
     
@@ -148,9 +292,11 @@ else:
 
 # --- KPIs ---
 # --- FIX: Use the new, correct column names ---
-total_living = filtered_data['Count_median_living'].sum()
-total_deaths = filtered_data['Count_median_deaths'].sum()
-avg_art_coverage = filtered_data['Estimated_ART_coverage_among_people_living_with_HIV_percent_median'].mean()
+# Aggregate the float32 columns in float64 so the totals stay exact
+kpis = filtered_data[[COL_LIVING, COL_DEATHS, COL_ART_ADULT]].astype('float64').agg(
+    {COL_LIVING: 'sum', COL_DEATHS: 'sum', COL_ART_ADULT: 'mean'}
+)
+total_living, total_deaths, avg_art_coverage = kpis[COL_LIVING], kpis[COL_DEATHS], kpis[COL_ART_ADULT]
 
 col1, col2, col3 = st.columns(3)
 with col1:
@@ -184,17 +330,7 @@ col1, col2 = st.columns((2, 1))
 with col1:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Global Distribution of People Living with HIV")
-    map_data = filtered_data[['Country', 'Count_median_living']].dropna()
-    fig_map = px.choropleth(
-        map_data,
-        locations="Country",
-        locationmode="country names",
-        color="Count_median_living",
-        color_continuous_scale=px.colors.sequential.Reds,
-        template="plotly_dark",
-        hover_name="Country"
-    )
-    fig_map.update_layout(margin={"r":0,"t":0,"l":0,"b":0}, paper_bgcolor="#1A1C2A")
+    fig_map = build_map(data_version, selected_region, tuple(selected_countries), filtered_data)
     st.plotly_chart(fig_map, use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -202,15 +338,7 @@ with col2:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Cases by Region")
     # Use original unfiltered data for the pie chart to always show global context
-    region_data = data.groupby('WHO_Region')['Count_median_living'].sum().reset_index()
-    fig_pie = px.pie(
-        region_data,
-        names='WHO_Region',
-        values='Count_median_living',
-        template="plotly_dark",
-        hole=0.4
-    )
-    fig_pie.update_layout(paper_bgcolor="#1A1C2A", legend_orientation="h")
+    fig_pie = build_region_pie(region_totals['living'])
     st.plotly_chart(fig_pie, use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -220,38 +348,28 @@ col1, col2 = st.columns(2)
 with col1:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("ART Coverage (Adult vs. Pediatric)")
-    art_data = filtered_data[['Country', 'Estimated_ART_coverage_among_people_living_with_HIV_percent_median', 'Estimated_ART_coverage_among_children_percent_median']].dropna()
-    art_data = art_data.melt(id_vars=['Country'], var_name='ART_Type', value_name='Coverage')
-    art_data['ART_Type'] = art_data['ART_Type'].replace({
-        'Estimated_ART_coverage_among_people_living_with_HIV_percent_median': 'Adults',
-        'Estimated_ART_coverage_among_children_percent_median': 'Children'
-    })
-    fig_art = px.bar(
-        art_data.groupby('ART_Type')['Coverage'].mean().reset_index(),
-        x='ART_Type',
-        y='Coverage',
-        color='ART_Type',
-        template="plotly_dark",
-        title="Average Coverage"
-    )
-    fig_art.update_layout(paper_bgcolor="#1A1C2A")
+    # Means over countries that report both adult and paediatric coverage
+    art_means = filtered_data[[COL_ART_ADULT, COL_ART_CHILD]].dropna().mean()
+    art_summary = pd.DataFrame({'ART_Type': ['Adults', 'Children'], 'Coverage': art_means.to_numpy()})
+    fig_art = build_art_bar(art_summary)
     st.plotly_chart(fig_art, use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
 with col2:
     st.markdown('<div class="card">', unsafe_allow_html=True)
     st.subheader("Prevention of Mother-to-Child Transmission")
-    pmtct_data = filtered_data[['Percentage_Recieved_median']].dropna()
-    avg_pmtct = pmtct_data['Percentage_Recieved_median'].mean()
-    fig_pmtct = go.Figure(go.Indicator(
-        mode="gauge+number",
-        value=avg_pmtct,
-        title={'text': "Average PMTCT Coverage"},
-        gauge={'axis': {'range': [None, 100]}, 'bar': {'color': "#2ECC71"}}
-    ))
-    fig_pmtct.update_layout(paper_bgcolor="#1A1C2A", font={'color': "white"})
+    pmtct_data = filtered_data[[COL_PMTCT]].dropna()
+    avg_pmtct = pmtct_data[COL_PMTCT].mean()
+    fig_pmtct = build_pmtct_gauge(avg_pmtct)
     st.plotly_chart(fig_pmtct, use_container_width=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
-with st.expander("Explore the Raw Data"):
-    st.dataframe(filtered_data)
+# A fragment, so toggling "Show all rows" reruns only the table and not the charts
+@st.fragment
+def render_raw_data(filtered_data):
+    with st.expander("Explore the Raw Data"):
+        # Only send the full table to the browser when it's asked for
+        show_all_rows = st.checkbox("Show all rows", value=False)
+        st.dataframe(filtered_data if show_all_rows else filtered_data.head(100))
+
+render_raw_data(filtered_data)